@@ -1,14 +1,21 @@
-import ast
+import asyncio
 import dataclasses
+import hashlib
+import io
 import json
 import logging
+import mmap
 import os
+import random
 import re
+import sqlite3
+import sys
 import time
 from pathlib import Path
-from typing import Optional, Union
+from typing import Iterator, Optional, Union
 
 import openai
+import orjson
 import tiktoken
 from dotenv import load_dotenv
 
@@ -28,90 +35,262 @@ PREDICTION_DIR = JP_BENCH_DIR / "model_answer"
 REFERENCE_DIR = JP_BENCH_DIR / "reference_answer"
 JUDGEMENT_DIR = JP_BENCH_DIR / "model_judgment"
 JUDGEMENT_PROMPT_FILE = JP_BENCH_DIR / "judge_prompts.jsonl"
+JUDGE_CACHE_FILE = JP_BENCH_DIR / "judge_cache.sqlite"
+
+# File I/O setting constants
+JSONL_WRITE_BUFFER_SIZE = 1 << 20
 
 # API setting constants
 API_MAX_RETRY = 16
-API_RETRY_SLEEP = 10
+API_RETRY_SLEEP_BASE = 1
+API_RETRY_SLEEP_MAX = 60
+BATCH_POLL_INTERVAL = 60
+RATE_LIMIT_COOLDOWN = 60
+
+# Judgement fields that share a handful of distinct values across a file
+REPEATED_JUDGEMENT_FIELDS = (
+    "model",
+    "model_1",
+    "model_2",
+    "g1_winner",
+    "g2_winner",
+    "judge_model",
+    "judge_prompt",
+)
 
 # Categories that need reference answers
-NEED_REF_CATS = ["math", "reasoning", "coding"]
+NEED_REF_CATS = frozenset({"math", "reasoning", "coding"})
 
 # Extract scores from judgments
 two_score_pattern = re.compile(r"\[\[(\d+\.?\d*),\s?(\d+\.?\d*)]]")
 two_score_pattern_backup = re.compile(r"\[(\d+\.?\d*),\s?(\d+\.?\d*)]")
-one_score_pattern = re.compile(r"\[\[(\d+\.?\d*)]]")
-one_score_pattern_another_format = re.compile(r"\[\[rating:(\d+)]]")
-one_score_pattern_another_format2 = re.compile(r"\[\[rating: (\d+)]]")
+one_score_pattern = re.compile(
+    r"\[\[(\d+\.?\d*)]]|\[\[rating:(\d+)]]|\[\[rating: (\d+)]]"
+)
+winner_pattern = re.compile(r"\[\[([ABC])]]")
+
+
+class RateLimiter:
+    """A token bucket that keeps requests within per-minute rate limits.
+
+    A limit that is not set has no bucket and never delays a request.
+
+    Args:
+        max_requests_per_minute (Optional[float]): The request rate limit.
+        max_tokens_per_minute (Optional[float]): The token rate limit.
+    """
+
+    def __init__(
+        self,
+        max_requests_per_minute: Optional[float] = None,
+        max_tokens_per_minute: Optional[float] = None,
+    ) -> None:
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_requests = max_requests_per_minute
+        self.available_tokens = max_tokens_per_minute
+        self.last_update = time.monotonic()
+        self.throttled_until = 0.0
+
+    def _refill(self) -> None:
+        """Refill the buckets according to the elapsed time."""
+        now = time.monotonic()
+        scale = 0.5 if now < self.throttled_until else 1.0
+        elapsed_minutes = (now - self.last_update) / 60
+        if self.max_requests_per_minute is not None:
+            self.available_requests = min(
+                self.max_requests_per_minute * scale,
+                self.available_requests
+                + elapsed_minutes * self.max_requests_per_minute,
+            )
+        if self.max_tokens_per_minute is not None:
+            self.available_tokens = min(
+                self.max_tokens_per_minute * scale,
+                self.available_tokens + elapsed_minutes * self.max_tokens_per_minute,
+            )
+        self.last_update = now
+
+    async def acquire(self, num_tokens: int) -> None:
+        """Wait until a request consuming `num_tokens` tokens can be sent."""
+        if self.max_tokens_per_minute is not None:
+            num_tokens = min(num_tokens, self.max_tokens_per_minute)
+        while True:
+            self._refill()
+            wait_minutes = 0.0
+            if self.max_requests_per_minute is not None:
+                wait_minutes = max(
+                    wait_minutes,
+                    (1 - self.available_requests) / self.max_requests_per_minute,
+                )
+            if self.max_tokens_per_minute is not None:
+                wait_minutes = max(
+                    wait_minutes,
+                    (num_tokens - self.available_tokens) / self.max_tokens_per_minute,
+                )
+            if wait_minutes <= 0:
+                if self.max_requests_per_minute is not None:
+                    self.available_requests -= 1
+                if self.max_tokens_per_minute is not None:
+                    self.available_tokens -= num_tokens
+                return
+            await asyncio.sleep(wait_minutes * 60)
+
+    def throttle(self) -> None:
+        """Halve the capacities for a while after hitting the rate limit."""
+        self.throttled_until = time.monotonic() + RATE_LIMIT_COOLDOWN
+        self._refill()
+
+
+class JudgeCache:
+    """A persistent cache of judge responses backed by SQLite.
+
+    Args:
+        cache_file (Union[str, Path]): The SQLite database file.
+    """
+
+    def __init__(self, cache_file: Union[str, Path]) -> None:
+        self.conn = sqlite3.connect(cache_file)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT)"
+        )
+
+    @staticmethod
+    def make_key(model: str, params: dict) -> str:
+        """Make a cache key from the judge model and the request parameters."""
+        messages = json.dumps(params["messages"], ensure_ascii=False)
+        key = f"{model}|{params['max_tokens']}|{params['temperature']}|{messages}"
+        return hashlib.blake2b(key.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT response FROM cache WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key: str, response: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)",
+            (key, response),
+        )
+        self.conn.commit()
 
 
 @dataclasses.dataclass
 class Judge:
     model: str
     prompt_template: dict
+    rate_limiter: Optional[RateLimiter] = None
+    cache: Optional[JudgeCache] = None
 
-    def judge(self, **kwargs):
+    def __post_init__(self) -> None:
+        prompt_template = self.prompt_template
+        self.name = prompt_template["name"]
+        self.type = prompt_template["type"]
+        self.output_format = prompt_template["output_format"]
+        self.system_prompt = prompt_template["system_prompt"]
+        self.template_str = prompt_template["prompt_template"]
+        self.format_prompt = self.template_str.format_map
+
+    def make_params(self, **kwargs) -> dict:
+        """Make the chat completion parameters, except for the model."""
         messages = [
-            {"role": "system", "content": self.prompt_template["system_prompt"]},
-            {
-                "role": "user",
-                "content": self.prompt_template["prompt_template"].format(**kwargs),
-            },
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": self.format_prompt(kwargs)},
         ]
-        for _ in range(API_MAX_RETRY):
+        return {"messages": messages, "temperature": 0, "max_tokens": 2048}
+
+    def count_tokens(self, params: dict) -> int:
+        """Count the tokens a request may consume, including the completion."""
+        enc = tiktoken.encoding_for_model(self.model)
+        num_input_tokens = sum(
+            len(enc.encode(message["content"])) for message in params["messages"]
+        )
+        return num_input_tokens + params["max_tokens"]
+
+    def get_cache_key(self, params: dict) -> Optional[str]:
+        """Get the cache key of a request, or None if it must not be cached."""
+        # Only deterministic requests are safe to answer from the cache
+        if self.cache is None or params["temperature"] != 0:
+            return None
+        return self.cache.make_key(self.model, params)
+
+    async def judge(self, **kwargs):
+        params = self.make_params(**kwargs)
+        key = self.get_cache_key(params)
+        if key is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+        if self.rate_limiter is not None:
+            num_tokens = self.count_tokens(params)
+        for attempt in range(API_MAX_RETRY):
             try:
-                params = {
-                    "messages": messages,
-                    "temperature": 0,
-                    "max_tokens": 2048,
-                }
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire(num_tokens)
                 if openai.api_type == "azure":
                     params["engine"] = self.model
                 else:
                     params["model"] = self.model
-                response = openai.ChatCompletion.create(**params)
-                return response["choices"][0]["message"]["content"]
+                response = await openai.ChatCompletion.acreate(**params)
+                content = response["choices"][0]["message"]["content"]
+                if key is not None:
+                    self.cache.set(key, content)
+                return content
             except openai.error.OpenAIError as e:
                 logger.warning(f"OpenAI API error: {e}")
-                time.sleep(API_RETRY_SLEEP)
+                if (
+                    isinstance(e, openai.error.RateLimitError)
+                    and self.rate_limiter is not None
+                ):
+                    self.rate_limiter.throttle()
+                sleep = min(API_RETRY_SLEEP_MAX, API_RETRY_SLEEP_BASE * 2**attempt)
+                await asyncio.sleep(random.random() * sleep)
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class MatchSingle:
     question: dict
     model: str
-    answer: dict
+    answer: tuple[str, ...]
     judge: Judge
-    ref_answer: Optional[dict] = None
+    ref_answer: Optional[tuple[str, ...]] = None
 
     def __post_init__(self) -> None:
-        if self.judge.prompt_template["type"] != "single":
-            raise ValueError(
-                f"invalid judge type: {self.judge.prompt_template['type']}"
-            )
-        if self.judge.prompt_template["output_format"] != "[[rating]]":
-            raise ValueError(
-                f"Invalid output format: {self.judge.prompt_template['output_format']}"
-            )
+        if self.judge.type != "single":
+            raise ValueError(f"invalid judge type: {self.judge.type}")
+        if self.judge.output_format != "[[rating]]":
+            raise ValueError(f"Invalid output format: {self.judge.output_format}")
 
-    def play(self):
-        """Play a single match."""
+    def get_games(self) -> list[dict]:
+        """Get the prompt arguments of each game in this match."""
         kwargs = {
             "question": self.question["turns"][0],
-            "answer": self.answer["choices"][0]["turns"][0],
+            "answer": self.answer[0],
         }
         if self.ref_answer:
-            kwargs["ref_answer_1"] = self.ref_answer["choices"][0]["turns"][0]
-        judgment = self.judge.judge(**kwargs)
+            kwargs["ref_answer_1"] = self.ref_answer[0]
+        return [kwargs]
+
+    async def play(self):
+        """Play a single match."""
+        judgments = await asyncio.gather(
+            *(self.judge.judge(**kwargs) for kwargs in self.get_games())
+        )
+        return self.make_result(judgments)
+
+    def make_result(self, judgments: list[str]) -> dict:
+        """Make the result of this match from the judgment of each game."""
+        (judgment,) = judgments
         score = self.get_score(judgment)
         return {
             "model": self.model,
             "question_id": self.question["question_id"],
             "question": self.question["turns"][0],
-            "answer": self.answer["choices"][0]["turns"][0],
+            "answer": self.answer[0],
             "judgment": judgment,
             "score": score,
             "judge_model": self.judge.model,
-            "judge_prompt": self.judge.prompt_template["name"],
+            "judge_prompt": self.judge.name,
             "tstamp": time.time(),
         }
 
@@ -119,14 +298,12 @@ class MatchSingle:
         enc = tiktoken.encoding_for_model(self.judge.model)
         num_input_tokens = (
             len(enc.encode(self.question["turns"][0]))
-            + len(enc.encode(self.answer["choices"][0]["turns"][0]))
-            + len(enc.encode(self.judge.prompt_template["system_prompt"]))
-            + len(enc.encode(self.judge.prompt_template["prompt_template"]))
+            + len(enc.encode(self.answer[0]))
+            + len(enc.encode(self.judge.system_prompt))
+            + len(enc.encode(self.judge.template_str))
         )
         if self.ref_answer:
-            num_input_tokens += len(
-                enc.encode(self.ref_answer["choices"][0]["turns"][0])
-            )
+            num_input_tokens += len(enc.encode(self.ref_answer[0]))
         num_output_tokens = 200  # Estimated from a few samples
         if self.judge.model in {"gpt-4", "gpt-4-0613"}:
             return (0.03 * num_input_tokens + 0.06 * num_output_tokens) / 1_000
@@ -137,54 +314,67 @@ class MatchSingle:
         raise AssertionError
 
     @staticmethod
-    def get_score(judgment: str) -> int:
-        match = (
-            re.search(one_score_pattern, judgment)
-            or re.search(one_score_pattern_another_format, judgment)
-            or re.search(one_score_pattern_another_format2, judgment)
-        )
-        if match:
-            return ast.literal_eval(match.groups()[0])
+    def get_score(judgment: str) -> Union[int, float]:
+        # An earlier format wins wherever it appears, so keep the first match of each
+        scores = [None] * one_score_pattern.groups
+        for match in one_score_pattern.finditer(judgment):
+            if scores[match.lastindex - 1] is None:
+                scores[match.lastindex - 1] = match.group(match.lastindex)
+            if match.lastindex == 1:
+                break
+        for score in scores:
+            if score is not None:
+                return float(score) if "." in score else int(score)
         return -1
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, slots=True)
 class MatchPair:
     question: dict
     model_1: str
     model_2: str
-    answer_1: dict
-    answer_2: dict
+    answer_1: tuple[str, ...]
+    answer_2: tuple[str, ...]
     judge: Judge
-    ref_answer: Optional[dict] = None
+    ref_answer: Optional[tuple[str, ...]] = None
 
     def __post_init__(self) -> None:
-        if self.judge.prompt_template["type"] != "pairwise":
-            raise ValueError(
-                f"invalid judge type: {self.judge.prompt_template['type']}"
-            )
-        if self.judge.prompt_template["output_format"] != "[[A]]":
-            raise ValueError(
-                f"Invalid output format: {self.judge.prompt_template['output_format']}"
-            )
-
-    def play(self):
-        """Play a pairwise match."""
-
-        def play(answer_a, answer_b):
+        if self.judge.type != "pairwise":
+            raise ValueError(f"invalid judge type: {self.judge.type}")
+        if self.judge.output_format != "[[A]]":
+            raise ValueError(f"Invalid output format: {self.judge.output_format}")
+
+    def get_games(self) -> list[dict]:
+        """Get the prompt arguments of each game in this match.
+
+        The second game swaps the answers to cancel out position bias.
+        """
+        games = []
+        for answer_a, answer_b in [
+            (self.answer_1, self.answer_2),
+            (self.answer_2, self.answer_1),
+        ]:
             kwargs = {
                 "question": self.question["turns"][0],
-                "answer_a": answer_a["choices"][0]["turns"][0],
-                "answer_b": answer_b["choices"][0]["turns"][0],
+                "answer_a": answer_a[0],
+                "answer_b": answer_b[0],
             }
             if self.ref_answer is not None:
-                kwargs["ref_answer_1"] = self.ref_answer["choices"][0]["turns"][0]
-            return self.judge.judge(**kwargs)
+                kwargs["ref_answer_1"] = self.ref_answer[0]
+            games.append(kwargs)
+        return games
+
+    async def play(self):
+        """Play a pairwise match. Both games are judged concurrently."""
+        judgments = await asyncio.gather(
+            *(self.judge.judge(**kwargs) for kwargs in self.get_games())
+        )
+        return self.make_result(judgments)
 
-        g1_judgment = play(self.answer_1, self.answer_2)
+    def make_result(self, judgments: list[str]) -> dict:
+        """Make the result of this match from the judgment of each game."""
+        g1_judgment, g2_judgment = judgments
         g1_winner = self.get_winner(g1_judgment, model_a="model_1", model_b="model_2")
-
-        g2_judgment = play(self.answer_2, self.answer_1)
         g2_winner = self.get_winner(g2_judgment, model_a="model_2", model_b="model_1")
 
         result = {
@@ -192,14 +382,14 @@ class MatchPair:
             "model_2": self.model_2,
             "question_id": self.question["question_id"],
             "question": self.question["turns"][0],
-            "answer_1": self.answer_1["choices"][0]["turns"][0],
-            "answer_2": self.answer_2["choices"][0]["turns"][0],
+            "answer_1": self.answer_1[0],
+            "answer_2": self.answer_2[0],
             "g1_judgment": g1_judgment,
             "g2_judgment": g2_judgment,
             "g1_winner": g1_winner,
             "g2_winner": g2_winner,
             "judge_model": self.judge.model,
-            "judge_prompt": self.judge.prompt_template["name"],
+            "judge_prompt": self.judge.name,
             "tstamp": time.time(),
         }
         return result
@@ -208,15 +398,13 @@ class MatchPair:
         enc = tiktoken.encoding_for_model(self.judge.model)
         num_input_tokens = (
             len(enc.encode(self.question["turns"][0]))
-            + len(enc.encode(self.answer_1["choices"][0]["turns"][0]))
-            + len(enc.encode(self.answer_2["choices"][0]["turns"][0]))
-            + len(enc.encode(self.judge.prompt_template["system_prompt"]))
-            + len(enc.encode(self.judge.prompt_template["prompt_template"]))
+            + len(enc.encode(self.answer_1[0]))
+            + len(enc.encode(self.answer_2[0]))
+            + len(enc.encode(self.judge.system_prompt))
+            + len(enc.encode(self.judge.template_str))
         )
         if self.ref_answer:
-            num_input_tokens += len(
-                enc.encode(self.ref_answer["choices"][0]["turns"][0])
-            )
+            num_input_tokens += len(enc.encode(self.ref_answer[0]))
         num_output_tokens = 200  # Estimated from a few samples
         if self.judge.model in {"gpt-4", "gpt-4-0613"}:
             return (0.03 * num_input_tokens + 0.06 * num_output_tokens) / 1_000
@@ -228,23 +416,178 @@ class MatchPair:
 
     @staticmethod
     def get_winner(judgment: str, model_a: str, model_b: str) -> str:
-        if "[[A]]" in judgment:
+        verdicts = set(winner_pattern.findall(judgment))
+        if "A" in verdicts:
             return model_a
-        elif "[[B]]" in judgment:
+        elif "B" in verdicts:
             return model_b
-        elif "[[C]]" in judgment:
+        elif "C" in verdicts:
             return "tie"
         return "error"
 
 
+class Batch(openai.api_resources.abstract.CreateableAPIResource):
+    """The OpenAI Batch API, which is missing in openai==0.28.1."""
+
+    OBJECT_NAME = "batches"
+
+
+def build_batch_requests(matches: list[Union[MatchSingle, MatchPair]]) -> list[dict]:
+    """Build Batch API requests for every game in the matches.
+
+    The custom ID of each request is `{match index}-{game index}`.
+
+    Args:
+        matches (list[Union[MatchSingle, MatchPair]]): A list of matches.
+    """
+    requests = []
+    for i, match in enumerate(matches):
+        for j, kwargs in enumerate(match.get_games()):
+            body = match.judge.make_params(**kwargs)
+            body["model"] = match.judge.model
+            requests.append(
+                {
+                    "custom_id": f"{i}-{j}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": body,
+                }
+            )
+    return requests
+
+
+def run_batch(requests: list[dict]) -> dict[str, str]:
+    """Run requests with the Batch API and wait for the batch to finish.
+
+    Args:
+        requests (list[dict]): A list of requests made by `build_batch_requests`.
+
+    Returns:
+        dict[str, str]: A map from custom ID to the generated message content.
+    """
+    data = b"".join(orjson.dumps(request) + b"\n" for request in requests)
+    input_file = openai.File.create(
+        file=io.BytesIO(data), purpose="batch", user_provided_filename="batch.jsonl"
+    )
+    batch = Batch.create(
+        input_file_id=input_file["id"],
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+    logger.info(f"Created batch {batch['id']}")
+    while batch["status"] not in {"completed", "failed", "expired", "cancelled"}:
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = Batch.retrieve(batch["id"])
+        logger.debug(f"Batch {batch['id']}: {batch['status']}")
+    if batch["status"] != "completed":
+        raise RuntimeError(f"Batch {batch['id']} is {batch['status']}")
+
+    # Failed requests are written to a separate error file
+    if batch.get("error_file_id"):
+        for line in openai.File.download(batch["error_file_id"]).splitlines():
+            if line.strip():
+                logger.warning(f"Batch request failed: {line.decode()}")
+
+    contents = {}
+    if not batch.get("output_file_id"):
+        logger.warning(f"Batch {batch['id']} has no successful requests")
+        return contents
+    for line in openai.File.download(batch["output_file_id"]).splitlines():
+        if not line.strip():
+            continue
+        output = orjson.loads(line)
+        if output["error"] or output["response"]["status_code"] != 200:
+            logger.warning(f"Batch request {output['custom_id']} failed: {output}")
+            continue
+        body = output["response"]["body"]
+        contents[output["custom_id"]] = body["choices"][0]["message"]["content"]
+    return contents
+
+
+def play_match_groups_batch(
+    match_groups: dict[str, list[Union[MatchSingle, MatchPair]]],
+) -> dict[str, list[dict]]:
+    """Play all match groups in a single batch of the Batch API.
+
+    Games whose judges have cached responses are answered from the cache, and only
+    the rest are sent. A group with any game whose request failed is left out of the
+    returned map, so that it is not saved and gets retried by the next run.
+
+    Args:
+        match_groups (dict): A map from match ID to a list of matches.
+    """
+    matches = [match for matches in match_groups.values() for match in matches]
+    if not matches:
+        return {match_id: [] for match_id in match_groups}
+    contents = {}
+    requests = []
+    cache_keys = {}
+    for request in build_batch_requests(matches):
+        custom_id = request["custom_id"]
+        judge = matches[int(custom_id.split("-")[0])].judge
+        key = judge.get_cache_key(request["body"])
+        response = judge.cache.get(key) if key is not None else None
+        if response is not None:
+            contents[custom_id] = response
+            continue
+        if key is not None:
+            cache_keys[custom_id] = (judge.cache, key)
+        requests.append(request)
+    if requests:
+        batch_contents = run_batch(requests)
+        for custom_id, (cache, key) in cache_keys.items():
+            if custom_id in batch_contents:
+                cache.set(key, batch_contents[custom_id])
+        contents.update(batch_contents)
+    results_map = {}
+    i = 0
+    for match_id, matches in match_groups.items():
+        match_judgments = []
+        for match in matches:
+            num_games = len(match.get_games())
+            match_judgments.append([contents.get(f"{i}-{j}") for j in range(num_games)])
+            i += 1
+        if any(None in judgments for judgments in match_judgments):
+            logger.warning(f"Batch requests of {match_id} are missing")
+            continue
+        results_map[match_id] = [
+            match.make_result(judgments)
+            for match, judgments in zip(matches, match_judgments)
+        ]
+    return results_map
+
+
+def iter_jsonl_mmap(path: Union[str, Path]) -> Iterator[dict]:
+    """Iterate over the records of a jsonl file through a memory map.
+
+    Only one line at a time is copied out of the page cache, so the whole file is
+    never held in memory.
+
+    Args:
+        path (Union[str, Path]): The jsonl file.
+    """
+    with open(path, "rb") as fin:
+        if os.fstat(fin.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            start, size = 0, len(mm)
+            while start < size:
+                end = mm.find(b"\n", start)
+                if end == -1:
+                    end = size
+                line = mm[start:end]
+                if line.strip():
+                    yield orjson.loads(line)
+                start = end + 1
+
+
 def load_questions(question_file: Union[str, Path]) -> list[dict]:
     """Load questions from a file.
 
     Args:
         question_file (Union[str, Path]): The question file.
     """
-    with open(question_file, "r") as fin:
-        return [json.loads(line) for line in fin]
+    return list(iter_jsonl_mmap(question_file))
 
 
 def get_model_list(answer_dir: Union[str, Path]):
@@ -253,21 +596,34 @@ def get_model_list(answer_dir: Union[str, Path]):
     Args:
         answer_dir (Union[str, Path]): The answer directory.
     """
-    return [path.name for path in Path(answer_dir).iterdir()]
+    with os.scandir(answer_dir) as entries:
+        return [entry.name for entry in entries if entry.is_dir()]
 
 
-def load_model_answers(answer_dir: Union[str, Path]):
-    """Load model answers.
+def load_model_answers(answer_dir: Union[str, Path]) -> dict[int, tuple[str, ...]]:
+    """Load the turns of the first choice of each model answer.
 
     Args:
         answer_dir (Union[str, Path]): The answer directory.
     """
-    answers = {}
-    with open(Path(answer_dir) / "results.jsonl", "r") as fin:
-        for line in fin:
-            answer = json.loads(line)
-            answers[answer["question_id"]] = answer
-    return answers
+    answers = iter_jsonl_mmap(Path(answer_dir) / "results.jsonl")
+    return {
+        answer["question_id"]: tuple(answer["choices"][0]["turns"])
+        for answer in answers
+    }
+
+
+def save_jsonl(path: Union[str, Path], records: list[dict]) -> None:
+    """Save records to a jsonl file through a large write buffer.
+
+    Args:
+        path (Union[str, Path]): The output file.
+        records (list[dict]): A list of records.
+    """
+    with open(path, "w", encoding="utf-8", buffering=JSONL_WRITE_BUFFER_SIZE) as f:
+        f.writelines(
+            json.dumps(record, ensure_ascii=False) + "\n" for record in records
+        )
 
 
 def load_model_config(answer_dir: Union[str, Path]):
@@ -287,12 +643,18 @@ def load_judgements(judgement_dir: Union[str, Path]):
         judgement_dir (Union[str, Path]): The judgement directory.
     """
     judgements = {}
-    for path in Path(judgement_dir).glob("*.jsonl"):
-        with open(path, "r") as fin:
+    with os.scandir(judgement_dir) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".jsonl"):
+                continue
             results = []
-            for line in fin:
-                results.append(json.loads(line))
-            judgements[path.stem] = results
+            for result in iter_jsonl_mmap(entry.path):
+                for field in REPEATED_JUDGEMENT_FIELDS:
+                    value = result.get(field)
+                    if isinstance(value, str):
+                        result[field] = sys.intern(value)
+                results.append(result)
+            judgements[entry.name[: -len(".jsonl")]] = results
     return judgements
 
 
@@ -302,12 +664,8 @@ def load_judge_prompts(prompt_file: Union[str, Path]):
     Args:
         prompt_file (Union[str, Path]): The prompt file.
     """
-    prompts = {}
-    with open(prompt_file) as fin:
-        for line in fin:
-            line = json.loads(line)
-            prompts[line["name"]] = line
-    return prompts
+    prompts = iter_jsonl_mmap(prompt_file)
+    return {prompt["name"]: prompt for prompt in prompts}
 
 
 def filter_single_judgements(
@@ -321,12 +679,12 @@ def filter_single_judgements(
     """
     if model_list is None:
         return result_id_results_map
-    filtered_result_id_results_map = {}
-    for result_id, results in result_id_results_map.items():
-        result = results[0]
-        if result["model"] in model_list:
-            filtered_result_id_results_map[result_id] = results
-    return filtered_result_id_results_map
+    models = set(model_list)
+    return {
+        result_id: results
+        for result_id, results in result_id_results_map.items()
+        if results[0]["model"] in models
+    }
 
 
 def filter_pairwise_judgements(
@@ -341,25 +699,28 @@ def filter_pairwise_judgements(
         model_list (list[str], optional): A list of models. Defaults to None.
         baseline_model (str, optional): The baseline model. Defaults to None.
     """
-    filtered_result_id_results_map = {}
-    for result_id, results in result_id_results_map.items():
-        result = results[0]
-        if model_list and baseline_model:
-            if (
-                result["model_1"] in model_list and result["model_2"] == baseline_model
-            ) or (
-                result["model_2"] in model_list and result["model_1"] == baseline_model
-            ):
-                filtered_result_id_results_map[result_id] = results
-        elif model_list and baseline_model is None:
-            if result["model_1"] in model_list and result["model_2"] in model_list:
-                filtered_result_id_results_map[result_id] = results
-        elif model_list is None and baseline_model:
-            if (
-                result["model_1"] == baseline_model
-                or result["model_2"] == baseline_model
-            ):
-                filtered_result_id_results_map[result_id] = results
-        else:
-            filtered_result_id_results_map[result_id] = results
-    return filtered_result_id_results_map
+    models = set(model_list or ())
+    if model_list and baseline_model:
+
+        def is_target(result: dict) -> bool:
+            return (
+                result["model_1"] in models and result["model_2"] == baseline_model
+            ) or (result["model_2"] in models and result["model_1"] == baseline_model)
+
+    elif model_list and baseline_model is None:
+
+        def is_target(result: dict) -> bool:
+            return result["model_1"] in models and result["model_2"] in models
+
+    elif model_list is None and baseline_model:
+
+        def is_target(result: dict) -> bool:
+            return baseline_model in {result["model_1"], result["model_2"]}
+
+    else:
+        return result_id_results_map
+    return {
+        result_id: results
+        for result_id, results in result_id_results_map.items()
+        if is_target(results[0])
+    }
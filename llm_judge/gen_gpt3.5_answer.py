@@ -6,7 +6,7 @@ import time
 
 import openai
 import shortuuid
-from common import PREDICTION_DIR, QUESTION_FILE, load_questions
+from common import PREDICTION_DIR, QUESTION_FILE, load_questions, save_jsonl
 from dotenv import load_dotenv
 from tqdm import tqdm
 
@@ -97,9 +97,7 @@ if __name__ == "__main__":
 
     logger.info("Save the results")
     prediction_dir.mkdir(parents=True, exist_ok=True)
-    with open(prediction_file, "w", encoding="utf-8") as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    save_jsonl(prediction_file, results)
     logger.info(f"Saved the results to {prediction_file}")
 
     logger.info("Save the config")
@@ -1,11 +1,11 @@
 import argparse
-import json
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor
 from itertools import combinations
-from typing import Optional
+from typing import Optional, Union
 
 from common import (
+    JUDGE_CACHE_FILE,
     JUDGEMENT_DIR,
     JUDGEMENT_PROMPT_FILE,
     NEED_REF_CATS,
@@ -13,14 +13,18 @@ from common import (
     QUESTION_FILE,
     REFERENCE_DIR,
     Judge,
+    JudgeCache,
     MatchPair,
     MatchSingle,
+    RateLimiter,
     get_model_list,
     load_judge_prompts,
     load_model_answers,
     load_questions,
+    play_match_groups_batch,
+    save_jsonl,
 )
-from tqdm import tqdm
+from tqdm.asyncio import tqdm_asyncio
 from upload_result import upload_results
 
 logger = logging.getLogger(__name__)
@@ -28,8 +32,8 @@ logger = logging.getLogger(__name__)
 
 def make_match_groups_single(
     questions: list[dict],
-    model_answers: dict[str, dict[int, dict]],
-    ref_answers: dict[str, dict[int, dict]],
+    model_answers: dict[str, dict[int, tuple[str, ...]]],
+    ref_answers: dict[str, dict[int, tuple[str, ...]]],
     judge_default: Judge,
     judge_math: Judge,
 ):
@@ -69,8 +73,8 @@ def make_match_groups_single(
 
 def make_match_groups_pairwise(
     questions: list[dict],
-    model_answers: dict[str, dict[int, dict]],
-    ref_answers: dict[str, dict[int, dict]],
+    model_answers: dict[str, dict[int, tuple[str, ...]]],
+    ref_answers: dict[str, dict[int, tuple[str, ...]]],
     judge_default: Judge,
     judge_math: Judge,
     baseline_model: Optional[str] = None,
@@ -115,6 +119,24 @@ def make_match_groups_pairwise(
     return match_groups
 
 
+async def play_matches(
+    matches: list[Union[MatchSingle, MatchPair]], parallel: int
+) -> list[dict]:
+    """Play matches concurrently.
+
+    Args:
+        matches (list): A list of matches.
+        parallel (int): The maximum number of matches played at the same time.
+    """
+    semaphore = asyncio.Semaphore(parallel)
+
+    async def play(match: Union[MatchSingle, MatchPair]) -> dict:
+        async with semaphore:
+            return await match.play()
+
+    return await tqdm_asyncio.gather(*(play(match) for match in matches))
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -150,7 +172,27 @@ if __name__ == "__main__":
         help="A list of models to be evaluated. If not specified, all models will be evaluated",
     )
     parser.add_argument(
-        "--parallel", type=int, default=1, help="The number of concurrent API calls."
+        "--parallel", type=int, default=1, help="The number of concurrent matches."
+    )
+    parser.add_argument(
+        "--max-requests-per-minute",
+        type=float,
+        help="The request rate limit of the judge model. Unlimited if not specified.",
+    )
+    parser.add_argument(
+        "--max-tokens-per-minute",
+        type=float,
+        help="The token rate limit of the judge model. Unlimited if not specified.",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help=f"Reuse judge responses cached in {JUDGE_CACHE_FILE.name}.",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Use the OpenAI Batch API. Results may take up to 24 hours to arrive.",
     )
     parser.add_argument("--first-n", type=int, help="Only run the first `n` judgments.")
     parser.add_argument(
@@ -202,31 +244,48 @@ if __name__ == "__main__":
         models = args.model_list
         if args.mode == "pairwise-baseline" and args.baseline_model not in models:
             models.append(args.baseline_model)
+    question_ids = {question["question_id"] for question in questions}
     model_answers = {}
     for model in sorted(models):
         answers = load_model_answers(PREDICTION_DIR / model)
-        for question in questions:
-            assert question["question_id"] in answers
+        missing_ids = question_ids - answers.keys()
+        assert not missing_ids, f"Missing answers of {model}: {sorted(missing_ids)}"
         model_answers[model] = answers
 
     logger.info("Load reference answers")
     judge_model = args.judge_model
     answers = load_model_answers(REFERENCE_DIR / "gpt-4")
-    for question in filter(lambda x: x["category"] in NEED_REF_CATS, questions):
-        assert question["question_id"] in answers
+    ref_question_ids = {
+        question["question_id"]
+        for question in questions
+        if question["category"] in NEED_REF_CATS
+    }
+    missing_ids = ref_question_ids - answers.keys()
+    assert not missing_ids, f"Missing reference answers: {sorted(missing_ids)}"
     ref_answers = {judge_model: answers}
 
     logger.info("Load judge prompts")
     judge_prompts = load_judge_prompts(JUDGEMENT_PROMPT_FILE)
 
+    rate_limiter = None
+    if args.max_requests_per_minute or args.max_tokens_per_minute:
+        rate_limiter = RateLimiter(
+            args.max_requests_per_minute, args.max_tokens_per_minute
+        )
+    cache = JudgeCache(JUDGE_CACHE_FILE) if args.cache else None
+
     logger.info("Make matches")
     if args.mode == "single":
         match_groups = make_match_groups_single(
             questions,
             model_answers,
             ref_answers=ref_answers,
-            judge_default=Judge(args.judge_model, judge_prompts["single"]),
-            judge_math=Judge(args.judge_model, judge_prompts["single-math"]),
+            judge_default=Judge(
+                args.judge_model, judge_prompts["single"], rate_limiter, cache
+            ),
+            judge_math=Judge(
+                args.judge_model, judge_prompts["single-math"], rate_limiter, cache
+            ),
         )
         output_dir = JUDGEMENT_DIR / "single" / args.judge_model
     else:
@@ -239,8 +298,12 @@ if __name__ == "__main__":
             questions,
             model_answers,
             ref_answers=ref_answers,
-            judge_default=Judge(args.judge_model, judge_prompts["pair"]),
-            judge_math=Judge(args.judge_model, judge_prompts["pair-math"]),
+            judge_default=Judge(
+                args.judge_model, judge_prompts["pair"], rate_limiter, cache
+            ),
+            judge_math=Judge(
+                args.judge_model, judge_prompts["pair-math"], rate_limiter, cache
+            ),
             baseline_model=baseline_model,
         )
         output_dir = JUDGEMENT_DIR / "pairwise" / args.judge_model
@@ -272,19 +335,21 @@ if __name__ == "__main__":
         input("Press Enter to confirm...")
 
     logger.info("Play matches")
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if args.batch:
+        batch_results_map = play_match_groups_batch(match_groups)
     for match_id, matches in match_groups.items():
         output_file = output_dir / f"{match_id}.jsonl"
-        results = []
-        with ThreadPoolExecutor(args.parallel) as executor:
-            futures = [executor.submit(match.play) for match in matches]
-            for future in tqdm(futures):
-                results.append(future.result())
+        if args.batch:
+            if match_id not in batch_results_map:
+                logger.warning(f"Skip {match_id}; some of its batch requests failed")
+                continue
+            results = batch_results_map[match_id]
+        else:
+            results = asyncio.run(play_matches(matches, args.parallel))
 
         logger.info(f"Write {len(results)} judgments")
-        output_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(output_file, "w") as f:
-            for result in results:
-                f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        save_jsonl(output_file, results)
         logger.info(f"Saved the judgments to {output_file}")
 
         if args.wandb:
@@ -7,7 +7,7 @@ import time
 import numpy as np
 import shortuuid
 import torch
-from common import PREDICTION_DIR, QUESTION_FILE, load_questions
+from common import PREDICTION_DIR, QUESTION_FILE, load_questions, save_jsonl
 from peft import PeftModel
 from tqdm import tqdm
 from transformers import AutoModelForCausalLM, AutoTokenizer
@@ -181,9 +181,7 @@ if __name__ == "__main__":
 
     logger.info("Save the results")
     prediction_dir.mkdir(parents=True, exist_ok=True)
-    with open(prediction_file, "w", encoding="utf-8") as f:
-        for result in results:
-            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+    save_jsonl(prediction_file, results)
     logger.info(f"Saved the results to {prediction_file}")
 
     logger.info("Save the config")
@@ -1,8 +1,7 @@
 import argparse
-import json
 import logging
 
-from common import JUDGEMENT_DIR, MatchPair, load_judgements
+from common import JUDGEMENT_DIR, MatchPair, load_judgements, save_jsonl
 
 logger = logging.getLogger(__name__)
 
@@ -53,8 +52,6 @@ if __name__ == "__main__":
                 for result, reparsed_result in zip(results, reparsed_results)
             ):
                 output_file = judgement_dir / f"{result_id}.jsonl"
-                with open(output_file, "w") as f:
-                    for result in reparsed_results:
-                        f.write(json.dumps(result, ensure_ascii=False) + "\n")
+                save_jsonl(output_file, reparsed_results)
                 logger.info(f"Fixed {output_file}")
     logger.info("Done")
@@ -1,6 +1,34 @@
+import asyncio
+import os
+import tempfile
 import unittest
+from typing import Optional
+from unittest import mock
 
-from llm_judge.common import MatchPair, MatchSingle
+from llm_judge.common import (
+    Judge,
+    JudgeCache,
+    MatchPair,
+    MatchSingle,
+    RateLimiter,
+    filter_pairwise_judgements,
+    iter_jsonl_mmap,
+    load_judgements,
+    play_match_groups_batch,
+)
+
+
+def make_judge(
+    judge_type: str, output_format: str, cache: Optional[JudgeCache] = None
+) -> Judge:
+    prompt_template = {
+        "name": judge_type,
+        "type": judge_type,
+        "output_format": output_format,
+        "system_prompt": "system",
+        "prompt_template": "{question}",
+    }
+    return Judge("gpt-4", prompt_template, cache=cache)
 
 
 class TestMatchSingle(unittest.TestCase):
@@ -11,6 +39,9 @@ class TestMatchSingle(unittest.TestCase):
         judgement = "[[2]]"
         self.assertEqual(MatchSingle.get_score(judgement), 2)
 
+        judgement = "[[2.5]]"
+        self.assertEqual(MatchSingle.get_score(judgement), 2.5)
+
         judgement = "[[rating:3]]"
         self.assertEqual(MatchSingle.get_score(judgement), 3)
 
@@ -23,6 +54,12 @@ class TestMatchSingle(unittest.TestCase):
         judgement = "[[rating: Perfect]]"
         self.assertEqual(MatchSingle.get_score(judgement), -1)
 
+        judgement = "[[rating: 3]] ... final [[5]]"
+        self.assertEqual(MatchSingle.get_score(judgement), 5)
+
+        judgement = "[[rating: 3]] ... [[rating:4]]"
+        self.assertEqual(MatchSingle.get_score(judgement), 4)
+
 
 class TestMatchPair(unittest.TestCase):
     def test_get_winner(self):
@@ -60,3 +97,202 @@ class TestMatchPair(unittest.TestCase):
             MatchPair.get_winner(judgement, model_a="model_1", model_b="model_2"),
             "error",
         )
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_acquire(self):
+        rate_limiter = RateLimiter(
+            max_requests_per_minute=2, max_tokens_per_minute=1_000
+        )
+        asyncio.run(rate_limiter.acquire(300))
+        self.assertEqual(rate_limiter.available_requests, 1)
+        self.assertAlmostEqual(rate_limiter.available_tokens, 700, places=0)
+
+    def test_throttle(self):
+        rate_limiter = RateLimiter(
+            max_requests_per_minute=2, max_tokens_per_minute=1_000
+        )
+        rate_limiter.throttle()
+        self.assertEqual(rate_limiter.available_requests, 1)
+        self.assertEqual(rate_limiter.available_tokens, 500)
+
+    def test_acquire_with_only_token_limit(self):
+        rate_limiter = RateLimiter(max_tokens_per_minute=60_000)
+        asyncio.run(rate_limiter.acquire(59_990))
+        # The token bucket runs short and refills 10 tokens in 10 ms
+        asyncio.run(asyncio.wait_for(rate_limiter.acquire(20), timeout=5))
+        self.assertIsNone(rate_limiter.available_requests)
+
+
+class TestFilterPairwiseJudgements(unittest.TestCase):
+    def test_filter_pairwise_judgements(self):
+        result_id_results_map = {
+            "pairwise:a_b": [{"model_1": "a", "model_2": "b"}],
+            "pairwise:a_c": [{"model_1": "a", "model_2": "c"}],
+            "pairwise:b_c": [{"model_1": "b", "model_2": "c"}],
+        }
+        self.assertEqual(
+            list(filter_pairwise_judgements(result_id_results_map)),
+            ["pairwise:a_b", "pairwise:a_c", "pairwise:b_c"],
+        )
+        self.assertEqual(
+            list(filter_pairwise_judgements(result_id_results_map, ["a", "b"])),
+            ["pairwise:a_b"],
+        )
+        self.assertEqual(
+            list(filter_pairwise_judgements(result_id_results_map, ["b"], "c")),
+            ["pairwise:b_c"],
+        )
+        self.assertEqual(
+            list(filter_pairwise_judgements(result_id_results_map, None, "c")),
+            ["pairwise:a_c", "pairwise:b_c"],
+        )
+
+
+class TestIterJsonlMmap(unittest.TestCase):
+    def iter_jsonl(self, data: bytes) -> list[dict]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "data.jsonl")
+            with open(path, "wb") as f:
+                f.write(data)
+            return list(iter_jsonl_mmap(path))
+
+    def test_iter_jsonl_mmap(self):
+        self.assertEqual(self.iter_jsonl(b'{"a": 1}\n{"b": 2}\n'), [{"a": 1}, {"b": 2}])
+
+        # Blank lines are skipped
+        self.assertEqual(
+            self.iter_jsonl(b'{"a": 1}\n\n\r\n{"b": 2}\n\n'), [{"a": 1}, {"b": 2}]
+        )
+
+        # The last line may lack a trailing newline
+        self.assertEqual(self.iter_jsonl(b'{"a": 1}\n{"b": 2}'), [{"a": 1}, {"b": 2}])
+
+        # Empty files cannot be memory-mapped but yield nothing
+        self.assertEqual(self.iter_jsonl(b""), [])
+
+
+class TestJudgeCache(unittest.TestCase):
+    def test_judge_with_cache(self):
+        judge = make_judge("single", "[[rating]]", JudgeCache(":memory:"))
+        response = {"choices": [{"message": {"content": "[[5]]"}}]}
+        with mock.patch(
+            "openai.ChatCompletion.acreate",
+            new_callable=mock.AsyncMock,
+            return_value=response,
+        ) as acreate:
+            self.assertEqual(asyncio.run(judge.judge(question="q1")), "[[5]]")
+            self.assertEqual(asyncio.run(judge.judge(question="q1")), "[[5]]")
+            self.assertEqual(asyncio.run(judge.judge(question="q2")), "[[5]]")
+        # The second request for q1 is answered from the cache
+        self.assertEqual(acreate.await_count, 2)
+
+
+class TestPlayMatchGroupsBatch(unittest.TestCase):
+    def setUp(self):
+        single_judge = make_judge("single", "[[rating]]")
+        pair_judge = make_judge("pairwise", "[[A]]")
+        self.match_groups = {
+            "single:a": [
+                MatchSingle(
+                    {"question_id": 1, "turns": ["q1"]}, "a", ("a1",), single_judge
+                ),
+                MatchSingle(
+                    {"question_id": 2, "turns": ["q2"]}, "a", ("a2",), single_judge
+                ),
+            ],
+            "single:b": [
+                MatchSingle(
+                    {"question_id": 1, "turns": ["q1"]}, "b", ("b1",), single_judge
+                ),
+            ],
+            "pairwise:a_b": [
+                MatchPair(
+                    {"question_id": 1, "turns": ["q1"]},
+                    "a",
+                    "b",
+                    ("a1",),
+                    ("b1",),
+                    pair_judge,
+                ),
+            ],
+        }
+
+    def test_play_match_groups_batch(self):
+        contents = {
+            "0-0": "[[1]]",
+            "1-0": "[[2]]",
+            "2-0": "[[3]]",
+            "3-0": "[[A]]",
+            "3-1": "[[B]]",
+        }
+        with mock.patch(
+            "llm_judge.common.run_batch", return_value=contents
+        ) as run_batch:
+            results_map = play_match_groups_batch(self.match_groups)
+        custom_ids = [request["custom_id"] for request in run_batch.call_args.args[0]]
+        self.assertEqual(custom_ids, ["0-0", "1-0", "2-0", "3-0", "3-1"])
+        self.assertEqual([r["score"] for r in results_map["single:a"]], [1, 2])
+        self.assertEqual([r["score"] for r in results_map["single:b"]], [3])
+        result = results_map["pairwise:a_b"][0]
+        self.assertEqual(
+            (result["g1_winner"], result["g2_winner"]), ("model_1", "model_1")
+        )
+
+    def test_play_match_groups_batch_with_failed_requests(self):
+        # The second game of the pairwise match and the second match of "single:a" failed
+        contents = {"0-0": "[[1]]", "2-0": "[[3]]", "3-0": "[[A]]"}
+        with mock.patch("llm_judge.common.run_batch", return_value=contents):
+            with self.assertLogs("llm_judge.common", level="WARNING") as logs:
+                results_map = play_match_groups_batch(self.match_groups)
+        self.assertEqual(list(results_map), ["single:b"])
+        self.assertEqual(len(logs.output), 2)
+
+    def test_play_match_groups_batch_without_matches(self):
+        with mock.patch("llm_judge.common.run_batch") as run_batch:
+            self.assertEqual(
+                play_match_groups_batch({"single:a": []}), {"single:a": []}
+            )
+        run_batch.assert_not_called()
+
+    def test_play_match_groups_batch_with_cache(self):
+        judge = make_judge("single", "[[rating]]", JudgeCache(":memory:"))
+        match_groups = {
+            "single:a": [
+                MatchSingle({"question_id": 1, "turns": ["q1"]}, "a", ("a1",), judge),
+                MatchSingle({"question_id": 2, "turns": ["q2"]}, "a", ("a2",), judge),
+            ],
+        }
+        params = judge.make_params(question="q1", answer="a1")
+        judge.cache.set(judge.get_cache_key(params), "[[1]]")
+        with mock.patch(
+            "llm_judge.common.run_batch", return_value={"1-0": "[[2]]"}
+        ) as run_batch:
+            results_map = play_match_groups_batch(match_groups)
+        custom_ids = [request["custom_id"] for request in run_batch.call_args.args[0]]
+        self.assertEqual(custom_ids, ["1-0"])
+        self.assertEqual([r["score"] for r in results_map["single:a"]], [1, 2])
+
+        # The batch output is cached, so the next run sends nothing
+        with mock.patch("llm_judge.common.run_batch") as run_batch:
+            results_map = play_match_groups_batch(match_groups)
+        run_batch.assert_not_called()
+        self.assertEqual([r["score"] for r in results_map["single:a"]], [1, 2])
+
+
+class TestLoadJudgements(unittest.TestCase):
+    def test_load_judgements(self):
+        with tempfile.TemporaryDirectory() as judgement_dir:
+            path = os.path.join(judgement_dir, "pairwise:gpt-3.5-turbo_b.jsonl")
+            with open(path, "w") as f:
+                f.write(
+                    '{"model_1": "gpt-3.5-turbo", "model_2": "b", "g1_winner": null}\n'
+                )
+                f.write(
+                    '{"model_1": "gpt-3.5-turbo", "model_2": "b", "g1_winner": "model_1"}\n'
+                )
+            judgements = load_judgements(judgement_dir)
+        results = judgements["pairwise:gpt-3.5-turbo_b"]
+        self.assertIsNone(results[0]["g1_winner"])
+        self.assertEqual(results[1]["g1_winner"], "model_1")
+        self.assertIs(results[0]["model_1"], results[1]["model_1"])